@@ -1,31 +1,47 @@
 import os
 import polib
-import requests
-import json
-import time
+import asyncio
+import contextlib
+import functools
+import orjson
 import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import aiohttp
+except ImportError:
+    # Fallback: requests in Threads, siehe post_deepl()
+    aiohttp = None
+    import requests
+    from requests.adapters import HTTPAdapter
+
 # ==============================
 # CONFIG
 # ==============================
 
 DEEPL_API_KEY = os.getenv("DEEPL_API_KEY")
-print (f"Using API-Key: {DEEPL_API_KEY}")
-if not DEEPL_API_KEY:
-    raise RuntimeError("DEEPL_API_KEY not set")
 
 DEEPL_URL = "https://api-free.deepl.com/v2/translate"
 PROTECTED_BRANDS = ["Prime", "Amazon", "Kodi", "Add-On", "Addon", "PrimeVideo"]
 BATCH_SIZE = 50
-CACHE_FILE = "./../translation_cache.json"
+CACHE_FILE = "./../translation_cache.db"
+LEGACY_CACHE_FILES = ["./../translation_cache.jsonl", "./../translation_cache.json"]
 MAX_RETRIES = 5
+MAX_CONCURRENCY = 8  # gleichzeitige Anfragen an DeepL
+RATE_LIMIT = 10      # Anfragen pro Sekunde (konservativ für den Free-Tier)
+RATE_BURST = 10
+PARALLEL_PARSE_MIN_FILES = 16  # darunter ist der Start der Worker-Prozesse teurer als das Parsen
 
 LANG_ROOT = Path("./plugin.video.amazon-test/resources/language")  # root folder containing resource.language.xx_xx
 
+# Unterstützte Sprachen, nur diese Ordner werden bearbeitet
+# (en_* ist die Referenz, de_de wird von Hand gepflegt)
 LANGUAGE_MAP = {
     "af_za": "AF", "ar_sa": "AR", "bg_bg": "BG",
-    "cs_cz": "CS", "da_dk": "DA", "de_de": "DE",
+    "cs_cz": "CS", "da_dk": "DA",
     "el_gr": "EL", "es_es": "ES", "et_ee": "ET",
     "fi_fi": "FI", "fr_fr": "FR", "hu_hu": "HU",
     "id_id": "ID", "it_it": "IT", "ja_jp": "JA",
@@ -41,15 +57,51 @@ LANGUAGE_MAP = {
 # CACHE
 # ==============================
 
-if os.path.exists(CACHE_FILE):
-    with open(CACHE_FILE, "r", encoding="utf-8") as f:
-        CACHE = json.load(f)
-else:
-    CACHE = {}
+# SQLite im WAL-Modus, Einträge werden einzeln geschrieben statt die ganze Datei neu
+CACHE = {}
+CACHE_DB = None  # sqlite3-Verbindung, wird in load_cache() geöffnet
 
-def save_cache():
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(CACHE, f, ensure_ascii=False, indent=2)
+def read_legacy_cache():
+    # Alter JSONL- (eine Zeile {key: value}) bzw. JSON-Cache
+    cache = {}
+    for path in LEGACY_CACHE_FILES:
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            if path.endswith(".jsonl"):
+                for line in f:
+                    try:
+                        cache.update(orjson.loads(line))
+                    except orjson.JSONDecodeError:
+                        # z.B. abgeschnittene letzte Zeile nach einem Absturz
+                        continue
+            else:
+                cache = orjson.loads(f.read())
+        break
+    return cache
+
+# Wird in process() aufgerufen, nicht beim Import (Worker-Prozesse importieren das Modul erneut)
+def load_cache():
+    global CACHE, CACHE_DB
+
+    CACHE_DB = sqlite3.connect(CACHE_FILE)
+    CACHE_DB.execute("PRAGMA journal_mode=WAL")
+    CACHE_DB.execute("PRAGMA synchronous=NORMAL")
+    CACHE_DB.execute("CREATE TABLE IF NOT EXISTS translations(key TEXT PRIMARY KEY, value TEXT)")
+
+    CACHE = dict(CACHE_DB.execute("SELECT key, value FROM translations"))
+    if not CACHE:
+        # Alten Cache einmalig übernehmen
+        CACHE = read_legacy_cache()
+        CACHE_DB.executemany("INSERT OR REPLACE INTO translations(key, value) VALUES (?, ?)", CACHE.items())
+        CACHE_DB.commit()
+
+def cache_put(key, value):
+    CACHE[key] = value
+    CACHE_DB.execute("INSERT OR REPLACE INTO translations(key, value) VALUES (?, ?)", (key, value))
+
+def commit_cache():
+    CACHE_DB.commit()
 
 # ==============================
 # PLACEHOLDER PROTECTION
@@ -59,24 +111,124 @@ PLACEHOLDER_PATTERN = re.compile(
     r'(%[-+#0-9.]*[a-zA-Z]|\{\w+(?::[^}]+)?\})'
 )
 
+# Längste Marken zuerst, damit "PrimeVideo" nicht als "Prime" erkannt wird
+BRAND_RE = re.compile(
+    r'\b(' + '|'.join(map(re.escape, sorted(PROTECTED_BRANDS, key=len, reverse=True))) + r')\b'
+)
+
+# Platzhalter und Marken in einem gemeinsamen Durchlauf.
+# \b wird gegen den Originaltext geprüft: eine Marke direkt an einem Platzhalter
+# ("Kodi%s", "{name}Kodi", "Prime%d") wird geschützt; früher verhinderte das
+# angrenzende "__PH_n__" den Wortgrenzen-Treffer.
+PROTECT_PATTERN = re.compile(
+    r'(?P<ph>' + PLACEHOLDER_PATTERN.pattern + r')|(?P<brand>' + BRAND_RE.pattern + r')'
+)
+
+RESTORE_PATTERN = re.compile(r'__PH_(\d+)__')
+
+# Gecacht, da dieselben kurzen UI-Strings in jeder Sprache wieder auftauchen
+@functools.lru_cache(maxsize=8192)
 def protect_placeholders(text):
-    placeholders = PLACEHOLDER_PATTERN.findall(text)
-    protected = text
-    for i, ph in enumerate(placeholders):
-        protected = protected.replace(ph, f"__PH_{i}__")
-    return protected, placeholders
+    # Platzhalter -> __PH_i__ (auch Duplikate mit eigenem Index),
+    # Markennamen -> <notranslate>…</notranslate>
+    placeholders = []
+
+    def repl(match):
+        if match.group("brand"):
+            return f"<notranslate>{match.group(0)}</notranslate>"
+        placeholders.append(match.group(0))
+        return f"__PH_{len(placeholders) - 1}__"
+
+    return PROTECT_PATTERN.sub(repl, text), tuple(placeholders)
 
 def restore_placeholders(text, placeholders):
-    restored = text
-    for i, ph in enumerate(placeholders):
-        restored = restored.replace(f"__PH_{i}__", ph)
-    return restored
+    def repl(match):
+        i = int(match.group(1))
+        # Unbekannte Indizes unverändert lassen
+        return placeholders[i] if i < len(placeholders) else match.group(0)
+
+    return RESTORE_PATTERN.sub(repl, text)
+
+# ==============================
+# RATE LIMIT
+# ==============================
+
+class TokenBucket:
+    # Proaktive Drosselung, damit DeepL gar nicht erst mit 429 antwortet
+
+    def __init__(self, rate, burst):
+        self.rate = rate    # Tokens pro Sekunde
+        self.burst = burst  # maximale Anzahl angesparter Tokens
+        self.max_rate = rate    # Obergrenzen, update() geht nie darüber hinaus
+        self.max_burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update(self, headers):
+        # X-RateLimit-* beschreibt ein Kontingent pro Zeitfenster, keine Rate pro Sekunde:
+        # verbleibende Anfragen / Sekunden bis zum Reset. Gilt nur für das aktuelle Fenster,
+        # daher bei jeder Antwort neu berechnen (höchstens bis zu den konfigurierten Werten).
+        remaining = headers.get("X-RateLimit-Remaining", "")
+        reset = headers.get("X-RateLimit-Reset", "")
+        try:
+            remaining = int(remaining)
+            reset = float(reset)
+        except ValueError:
+            return
+
+        if reset > 1e9:
+            # Manche Server senden einen Unix-Zeitstempel statt Sekunden
+            reset -= time.time()
+        if reset <= 0:
+            return
+
+        self.rate = min(self.max_rate, max(remaining, 1) / reset)
+        self.burst = min(self.max_burst, max(remaining, 1))
+        # Nicht mehr angesparte Tokens behalten, als der Server noch erlaubt
+        self.tokens = min(self.tokens, self.burst)
 
 # ==============================
 # DEEPL BATCH TRANSLATE
 # ==============================
 
-def deepl_batch_translate(texts, target_lang):
+if aiohttp is None:
+    # Eine Session für alle Anfragen, Keep-Alive spart den TLS-Handshake pro Batch
+    SESSION = requests.Session()
+    SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=0))
+
+async def post_deepl(session, headers, payload):
+    # Liefert (status, headers, body) für aiohttp und den requests-Fallback
+    if aiohttp is None:
+        response = await asyncio.to_thread(
+            SESSION.post,
+            DEEPL_URL,
+            headers=headers,
+            json=payload,
+            timeout=60
+        )
+        return response.status_code, response.headers, response.content
+
+    async with session.post(
+        DEEPL_URL,
+        headers=headers,
+        json=payload,
+        timeout=aiohttp.ClientTimeout(total=60)
+    ) as response:
+        return response.status, response.headers, await response.read()
+
+async def deepl_batch_translate(session, sem, bucket, texts, target_lang):
     # Header exakt wie in der Doc, 'DeepL-Auth-Key' ist wichtig
     headers = {
         "Authorization": f"DeepL-Auth-Key {DEEPL_API_KEY}",
@@ -100,141 +252,221 @@ def deepl_batch_translate(texts, target_lang):
 
     for attempt in range(MAX_RETRIES):
         try:
-            # json=payload setzt automatisch den Content-Type auf application/json
-            response = requests.post(
-                DEEPL_URL,
-                headers=headers,
-                json=payload, 
-                timeout=60
-            )
-
-            if response.status_code == 200:
-                return [t["text"] for t in response.json()["translations"]]
-            
+            # Semaphore begrenzt die Anzahl gleichzeitiger Anfragen
+            async with sem:
+                await bucket.acquire()
+                status, response_headers, body = await post_deepl(session, headers, payload)
+
+            bucket.update(response_headers)
+
+            if status == 200:
+                # Rohdaten direkt mit orjson dekodieren
+                return [t["text"] for t in orjson.loads(body)["translations"]]
+
             # Falls immer noch Fehler, Details ausgeben
-            print(f"DeepL Fehler {response.status_code}: {response.text}")
-            
-            if response.status_code == 429:
-                time.sleep(2 ** attempt)
+            print(f"DeepL Fehler {status}: {body.decode('utf-8', 'replace')}")
+
+            if status == 429:
+                await asyncio.sleep(2 ** attempt)
                 continue
             break
 
         except Exception as e:
             print(f"Verbindungsfehler: {e}")
-            time.sleep(2 ** attempt)
+            await asyncio.sleep(2 ** attempt)
 
     raise RuntimeError("Anfrage an DeepL fehlgeschlagen.")
 
 
+def apply_translation(entry, msgstr):
+    entry.msgstr = msgstr
+    # Flag-Liste nur neu bauen, wenn sie "fuzzy" überhaupt enthält
+    if "fuzzy" in entry.flags:
+        entry.flags = [f for f in entry.flags if f != "fuzzy"]
+
+
+async def translate_batch(session, sem, bucket, batch, target_lang):
+    # batch: [(msgid, [entries...])], jede msgid kommt nur einmal vor
+    protected_texts = []
+    placeholder_sets = []
+
+    for msgid, entries in batch:
+
+        # Platzhalter und Markennamen (<notranslate>) in einem Durchlauf schützen
+        protected, placeholders = protect_placeholders(msgid)
+
+        protected_texts.append(protected)
+        placeholder_sets.append((msgid, entries, placeholders))
+
+    translations = await deepl_batch_translate(session, sem, bucket, protected_texts, target_lang)
+
+    for (msgid, entries, placeholders), translated in zip(placeholder_sets, translations):
+
+        restored = restore_placeholders(translated.replace("<notranslate>", "").replace("</notranslate>", ""), placeholders)
+        for entry in entries:
+            apply_translation(entry, restored)
+
+        cache_put(f"{target_lang}:{msgid}", restored)
+
+    # Einmal pro Batch committen
+    commit_cache()
+
+
+async def translate_language(session, sem, bucket, io_pool, batches, target_lang, po_files):
+    await asyncio.gather(*(
+        translate_batch(session, sem, bucket, batch, target_lang)
+        for batch in batches
+    ))
+
+    # Speichern im Thread, während andere Sprachen noch übersetzt werden
+    # (po wird danach nicht mehr verändert)
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(
+        loop.run_in_executor(io_pool, save_po, po)
+        for po in po_files
+    ))
+
+
+async def translate_all(io_pool, jobs, po_files):
+    # Eine Session für alle Anfragen, Verbindungen werden wiederverwendet
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    bucket = TokenBucket(RATE_LIMIT, RATE_BURST)  # gemeinsam für alle Anfragen
+    if aiohttp is None:
+        client = contextlib.nullcontext()  # requests-Fallback nutzt SESSION
+    else:
+        connector = aiohttp.TCPConnector(limit=64, limit_per_host=16)
+        client = aiohttp.ClientSession(connector=connector)
+
+    async with client as session:
+        await asyncio.gather(*(
+            translate_language(session, sem, bucket, io_pool, jobs.get(target_lang, []), target_lang, files)
+            for target_lang, files in po_files.items()
+        ))
+
+
 # ==============================
 # MAIN
 # ==============================
 
+def load_po(path):
+    # wrapwidth=0: keine Zeilenumbrüche beim Speichern (wie en_gb/de_de). Die bisher
+    # mit polibs Standardbreite 78 geschriebenen Dateien werden beim ersten Lauf
+    # einmalig auf eine Zeile pro String umgebrochen.
+    return polib.pofile(str(path), wrapwidth=0)
+
+
+def load_po_files(paths):
+    if len(paths) < PARALLEL_PARSE_MIN_FILES:
+        return [load_po(path) for path in paths]
+
+    # Viele Dateien: parallel in Worker-Prozessen parsen
+    with ProcessPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1)) as pool:
+        return list(pool.map(load_po, paths))
+
+
+def save_po(po):
+    po.save()
+
+
 def process():
 
+    # Hier statt beim Import, damit Worker-Prozesse (spawn) das nicht wiederholen
+    print (f"Using API-Key: {DEEPL_API_KEY}")
+    if not DEEPL_API_KEY:
+        raise RuntimeError("DEEPL_API_KEY not set")
+
+    load_cache()
+
     # Load English reference
     en_path = next(LANG_ROOT.glob("resource.language.en_*/strings.po"), None)
     if not en_path:
         raise RuntimeError("English reference not found")
 
-    en_po = polib.pofile(str(en_path))
-    en_dict = {e.msgid: e for e in en_po if e.msgid.strip()}
+    languages = []  # (lang_code, target_lang, po_path)
+    for lang_code, target_lang in LANGUAGE_MAP.items():
 
-    for lang_dir in LANG_ROOT.glob("resource.language.*"):
+        po_path = LANG_ROOT / f"resource.language.{lang_code}" / "strings.po"
+        if not po_path.exists():
+            continue
 
-        lang_code = lang_dir.name.replace("resource.language.", "").lower()
+        languages.append((lang_code, target_lang, po_path))
 
-        if lang_code.startswith("en") or lang_code.startswith("de"):
-            continue
+    en_po, *lang_pos = load_po_files([en_path] + [po_path for _, _, po_path in languages])
+    en_dict = {e.msgid: e for e in en_po if e.msgid.strip()}
 
-        target_lang = LANGUAGE_MAP.get(lang_code)
-        if not target_lang:
-            print(f"\nSkipping unsupported: {lang_code}")
-            continue
+    # Speichern läuft in Threads, während andere Sprachen noch übersetzt werden
+    with ThreadPoolExecutor(max_workers=2) as io_pool:
 
-        po_path = lang_dir / "strings.po"
-        if not po_path.exists():
-            continue
+        work = {}      # target_lang -> {msgid: [entries...]}
+        po_files = {}  # target_lang -> geänderte Dateien, werden nach der Übersetzung gespeichert
+
+        for (lang_code, target_lang, _), po in zip(languages, lang_pos):
 
-        print(f"\nProcessing {lang_code} → {target_lang}")
+            print(f"\nProcessing {lang_code} → {target_lang}")
 
-        po = polib.pofile(str(po_path))
-        existing_ids = {e.msgid for e in po}
-        entries_to_translate = []
-        new_strings_count = 0  # Zähler für neue IDs
+            by_id = {e.msgid: e for e in po}
 
-        # 1️⃣ Add missing entries from English (inkl. msgctxt!)
-        for msgid, en_entry in en_dict.items():
-            if msgid not in existing_ids:
-                new_entry = polib.POEntry(
+            # 1️⃣ Add missing entries from English (inkl. msgctxt!)
+            missing_ids = en_dict.keys() - by_id.keys()
+            # Nur bei fehlenden IDs über die Referenz laufen, Reihenfolge wie im Englischen
+            new_entries = [
+                polib.POEntry(
                     msgid=msgid,
                     msgstr="",
                     msgctxt=en_entry.msgctxt  # WICHTIG: Kontext kopieren
                 )
-                po.append(new_entry)
-                entries_to_translate.append(new_entry)
-                new_strings_count += 1
-
-        # 2️⃣ Find empty or fuzzy entries
-        # (Zähler für alle, die eine Übersetzung brauchen)
-        initial_translate_count = len(list(set(entries_to_translate))) 
-        for entry in po:
-            if (not entry.msgstr.strip() or "fuzzy" in entry.flags) and entry.msgid.strip():
-                entries_to_translate.append(entry)
-
-        # Remove duplicates
-        entries_to_translate = list(set(entries_to_translate))
-        total_to_translate = len(entries_to_translate)
+                for msgid, en_entry in en_dict.items()
+                if msgid in missing_ids
+            ] if missing_ids else []
+            new_strings_count = len(new_entries)  # Zähler für neue IDs
+
+            # 2️⃣ Find empty or fuzzy entries (obsolete Einträge auslassen)
+            # Vor dem Anhängen suchen, damit die neuen Einträge nicht doppelt auftauchen
+            # Nicht polibs untranslated_entries(): das zählt nur msgstr == "" als leer
+            fuzzy_or_empty = [
+                e for e in po
+                if not e.obsolete and e.msgid.strip() and (not e.msgstr.strip() or e.fuzzy)
+            ]
+            po.extend(new_entries)
+
+            entries_to_translate = new_entries + fuzzy_or_empty
+            total_to_translate = len(entries_to_translate)
         
-        if total_to_translate == 0:
-            print("   -> Language is already up to date.")
-            continue
-        else:
-            print(f"   -> Added {new_strings_count} missing strings from English reference.")
-            print(f"   -> Total strings to translate/update: {total_to_translate}")
+            if total_to_translate == 0:
+                print("   -> Language is already up to date.")
+                continue
+            else:
+                print(f"   -> Added {new_strings_count} missing strings from English reference.")
+                print(f"   -> Empty or fuzzy strings: {total_to_translate - new_strings_count}")
+                print(f"   -> Total strings to translate/update: {total_to_translate}")
 
             
-        # 3️⃣ Translate in batches
-        for i in range(0, len(entries_to_translate), BATCH_SIZE):
-
-            batch = entries_to_translate[i:i+BATCH_SIZE]
-            protected_texts = []
-            placeholder_sets = []
-
-            for entry in batch:
-
-                cache_key = f"{target_lang}:{entry.msgid}"
-                if cache_key in CACHE:
-                    entry.msgstr = CACHE[cache_key]
-                    entry.flags = [f for f in entry.flags if f != "fuzzy"]
+            # 3️⃣ Group by msgid, identical strings are translated only once per language
+            pending = work.setdefault(target_lang, {})
+            for entry in entries_to_translate:
+                pending.setdefault(entry.msgid, []).append(entry)
+
+            po_files.setdefault(target_lang, []).append(po)
+
+        # 4️⃣ Take what we can from the cache, batch the rest
+        jobs = {}  # target_lang -> [batch, ...]
+        for target_lang, pending in work.items():
+            misses = []
+            for msgid, entries in pending.items():
+                cached = CACHE.get(f"{target_lang}:{msgid}")
+                if cached is None:
+                    misses.append((msgid, entries))
                     continue
-                    
-                protected, placeholders = protect_placeholders(entry.msgid)
-                
-                # NEU: Markennamen mit XML-Tags schützen
-                for brand in PROTECTED_BRANDS:
-                    # Nutze Case-Insensitive Replace oder exakten Match
-                    protected = protected.replace(brand, f"<notranslate>{brand}</notranslate>")
-
-                protected_texts.append(protected)
-                placeholder_sets.append((entry, placeholders))
-
-            if not protected_texts:
-                continue
-
-            translations = deepl_batch_translate(protected_texts, target_lang)
-
-            for (entry, placeholders), translated in zip(placeholder_sets, translations):
+                for entry in entries:
+                    apply_translation(entry, cached)
 
-                restored = restore_placeholders(translated.replace("<notranslate>", "").replace("</notranslate>", ""), placeholders)
-                entry.msgstr = restored
-                entry.flags = [f for f in entry.flags if f != "fuzzy"]
+            jobs[target_lang] = [misses[i:i+BATCH_SIZE] for i in range(0, len(misses), BATCH_SIZE)]
 
-                CACHE[f"{target_lang}:{entry.msgid}"] = restored
+        print(f"\nTranslating {sum(map(len, jobs.values()))} batches...")
+        asyncio.run(translate_all(io_pool, jobs, po_files))
 
-        po.save()
+    CACHE_DB.close()
 
-    save_cache()
     print("\nAll languages synchronized and translated.")
 
 # ==============================